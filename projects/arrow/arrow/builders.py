@@ -5,6 +5,7 @@
 # license that can be found in the LICENSE_BSD file.
 
 import textwrap
+from types import MappingProxyType
 
 from buildbot.plugins import util
 from ursabot.builders import DockerBuilder
@@ -27,8 +28,46 @@ checkout_arrow = GitHub(
     mode='full'
 )
 
+
+@util.renderer
+def simd_level(props):
+    # the builders may run on ARM workers which cannot compile AVX2 kernels,
+    # None lets the CMake step fall back to the Arrow's default level
+    worker = props.getBuild().workerforbuilder.worker
+    if worker.platform.arch == 'amd64':
+        return 'AVX2'
+
+
+# the install target depends on all of the other targets, so by default
+# compile and install with a single ninja invocation to load and stat the
+# build graph only once, set the `split_compile` property to run the compile
+# step separately (e.g. to have separate logs for debugging)
+# the property accepts booleans and the true/false, on/off, yes/no and 1/0
+# strings (case insensitive), because the properties passed from the command
+# line are strings, but buildbot only treats a rendered doStepIf as a flag if
+# it is a bool
+_boolean_strings = {
+    'true': True, 'on': True, 'yes': True, '1': True,
+    'false': False, 'off': False, 'no': False, '0': False
+}
+
+
+@util.renderer
+def split_compile(props):
+    value = props.getProperty('split_compile', False)
+    if isinstance(value, str):
+        try:
+            return _boolean_strings[value.lower()]
+        except KeyError:
+            raise ValueError(
+                f'Invalid value for the split_compile property: `{value}`'
+            )
+    return bool(value)
+
+
 # explicitly define build definitions, exported via cmake -LAH
-definitions = dict(
+# the defaults are read-only, override them with properties instead
+default_definitions = MappingProxyType(dict(
     # CMake flags
     CMAKE_BUILD_TYPE='debug',
     CMAKE_INSTALL_PREFIX=None,
@@ -92,6 +131,8 @@ definitions = dict(
     ARROW_IPC='ON',
     # Build the Arrow jemalloc-based allocator
     ARROW_JEMALLOC='ON',
+    # Build the Arrow mimalloc-based allocator
+    ARROW_MIMALLOC='ON',
     # Exclude deprecated APIs from build
     # 'ARROW_NO_DEPRECATED_API': 'OFF',
     # Only define the lint and check-format targets
@@ -124,14 +165,19 @@ definitions = dict(
     # 'ARROW_TEST_MEMCHECK': 'OFF',
     # Enable Address Sanitizer checks
     # 'ARROW_USE_ASAN': 'OFF',
-    # Use ccache when compiling (if available)
-    # 'ARROW_USE_CCACHE': 'ON',
+    # Use ccache when compiling (if available), this is Arrow's default, but
+    # it is set explicitly because ccache_env configures the cache
+    ARROW_USE_CCACHE='ON',
     # Build libraries with glog support for pluggable logging
     # 'ARROW_USE_GLOG': 'ON',
     # Use ld.gold for linking on Linux (if available)
-    # 'ARROW_USE_LD_GOLD': 'OFF',
+    ARROW_USE_LD_GOLD='ON',
     # Build with SIMD optimizations
     # 'ARROW_USE_SIMD': 'ON',
+    # Compile time SIMD optimization level, depends on the worker's arch
+    ARROW_SIMD_LEVEL=simd_level,
+    # Max runtime SIMD optimization level, dispatched based on the CPU
+    ARROW_RUNTIME_SIMD_LEVEL='MAX',
     # Enable Thread Sanitizer checks
     # 'ARROW_USE_TSAN': 'OFF',
     # If off, 'quiet' flags will be passed to linting tools
@@ -162,8 +208,11 @@ definitions = dict(
     # Depend only on Thirdparty headers to build libparquet.
     # Always OFF if building binaries
     PARQUET_MINIMAL_DEPENDENCY='OFF'
-)
-definitions = {k: util.Property(k, default=v) for k, v in definitions.items()}
+))
+# CMake step requires a plain dictionary in order to render the properties
+definitions = {
+    k: util.Property(k, default=v) for k, v in default_definitions.items()
+}
 
 ld_library_path = util.Interpolate(
     '%(prop:CMAKE_INSTALL_PREFIX)s/%(prop:CMAKE_INSTALL_LIBDIR)s'
@@ -174,6 +223,17 @@ arrow_test_data_path = util.Interpolate(
 parquet_test_data_path = util.Interpolate(
     '%(prop:builddir)s/cpp/submodules/parquet-testing/data'
 )
+# both jemalloc and mimalloc are built, the tests use mimalloc by default,
+# set the ARROW_DEFAULT_MEMORY_POOL property to choose another allocator
+memory_pool = util.Property('ARROW_DEFAULT_MEMORY_POOL', default='mimalloc')
+# configure ccache explicitly for the C++ builders: the cache directory is
+# ccache's default for root, but it is mounted from the host (see the
+# builders' volumes), so pin it, compress the cache and cap its size
+ccache_env = dict(
+    CCACHE_DIR='/root/.ccache',
+    CCACHE_COMPRESS='1',
+    CCACHE_MAXSIZE='5G'
+)
 
 cpp_mkdir = Mkdir(
     dir='cpp/build',
@@ -188,7 +248,8 @@ cpp_cmake = CMake(
 cpp_compile = Ninja(
     j=util.Property('ncpus', 6),
     name='Compile C++',
-    workdir='cpp/build'
+    workdir='cpp/build',
+    doStepIf=split_compile
 )
 cpp_test = CTest(
     j=util.Property('ncpus', 6),
@@ -197,6 +258,7 @@ cpp_test = CTest(
 )
 cpp_install = Ninja(
     'install',
+    j=util.Property('ncpus', 6),
     name='Install C++',
     workdir='cpp/build'
 )
@@ -212,10 +274,12 @@ c_glib_meson = Meson(
 c_glib_compile = Ninja(
     j=util.Property('ncpus', 6),
     name='Compile C GLib',
-    workdir='c_glib/build'
+    workdir='c_glib/build',
+    doStepIf=split_compile
 )
 c_glib_install = Ninja(
     'install',
+    j=util.Property('ncpus', 6),
     name='Install C GLib',
     workdir='c_glib/build'
 )
@@ -353,7 +417,9 @@ class CppTest(DockerBuilder):
     )
     env = {
         'ARROW_TEST_DATA': arrow_test_data_path,
-        'PARQUET_TEST_DATA': parquet_test_data_path
+        'PARQUET_TEST_DATA': parquet_test_data_path,
+        'ARROW_DEFAULT_MEMORY_POOL': memory_pool,
+        **ccache_env
     }
     steps = [
         checkout_arrow,
@@ -518,7 +584,9 @@ class CppCondaTest(DockerBuilder):
     )
     env = dict(
         ARROW_TEST_DATA=arrow_test_data_path,  # for flight
-        PARQUET_TEST_DATA=parquet_test_data_path  # for parquet
+        PARQUET_TEST_DATA=parquet_test_data_path,  # for parquet
+        ARROW_DEFAULT_MEMORY_POOL=memory_pool,
+        **ccache_env
     )
     steps = [
         SetPropertiesFromEnv(dict(
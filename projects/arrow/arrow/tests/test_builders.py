@@ -0,0 +1,104 @@
+# Copyright 2019 RStudio, Inc.
+# All rights reserved.
+#
+# Use of this source code is governed by a BSD 2-Clause
+# license that can be found in the LICENSE_BSD file.
+
+import pytest
+from buildbot.process.properties import Properties
+from buildbot.process.results import SKIPPED, SUCCESS
+from buildbot.test.fake.remotecommand import ExpectShell
+from ursabot.steps import CMake
+from ursabot.tests.test_steps import BuildStepTestCase
+from ursabot.utils import Platform, ensure_deferred
+
+from ..builders import simd_level, split_compile
+from ..steps import Ninja
+
+
+def render(renderable, **properties):
+    props = Properties()
+    for name, value in properties.items():
+        props.setProperty(name, value, 'test')
+    return props.render(renderable)
+
+
+class TestSimdLevel(BuildStepTestCase):
+
+    def setupCMake(self, arch):
+        self.setupStep(
+            CMake(path='..', definitions={'ARROW_SIMD_LEVEL': simd_level})
+        )
+        worker = self.build.workerforbuilder.worker
+        worker.platform = Platform(arch=arch, distro='ubuntu', version='18.04')
+
+    def test_amd64(self):
+        self.setupCMake('amd64')
+        self.expectCommands(
+            ExpectShell(
+                workdir='wkdir',
+                command=['cmake', '..', '-DARROW_SIMD_LEVEL=AVX2']
+            ) + 0
+        )
+        self.expectOutcome(result=SUCCESS)
+        return self.runStep()
+
+    def test_arm64v8(self):
+        # the definition is left out to use Arrow's default level
+        self.setupCMake('arm64v8')
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', command=['cmake', '..']) + 0
+        )
+        self.expectOutcome(result=SUCCESS)
+        return self.runStep()
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    (True, True),
+    (False, False),
+    ('true', True),
+    ('false', False),
+    ('ON', True),
+    ('Off', False),
+    ('yes', True),
+    ('no', False),
+    ('1', True),
+    ('0', False)
+])
+def test_split_compile(value, expected):
+    result = render(split_compile, split_compile=value).result
+    assert result is expected
+
+
+def test_split_compile_defaults_to_false():
+    assert render(split_compile).result is False
+
+
+def test_split_compile_rejects_invalid_strings():
+    failures = []
+    render(split_compile, split_compile='maybe').addErrback(failures.append)
+    assert len(failures) == 1
+    assert failures[0].check(ValueError)
+
+
+class TestSplitCompile(BuildStepTestCase):
+
+    def setupCompile(self, value):
+        self.setupStep(Ninja(doStepIf=split_compile))
+        self.properties.setProperty('split_compile', value, 'test')
+
+    @ensure_deferred
+    async def test_compile_runs_if_enabled(self):
+        self.setupCompile('true')
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', command=['ninja']) + 0
+        )
+        self.expectOutcome(result=SUCCESS)
+        await self.runStep()
+
+    @ensure_deferred
+    async def test_compile_is_skipped_if_disabled(self):
+        # a non-bool doStepIf would be called by buildbot instead
+        self.setupCompile('false')
+        self.expectOutcome(result=SKIPPED)
+        await self.runStep()
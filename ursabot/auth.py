@@ -4,12 +4,21 @@
 # Use of this source code is governed by a BSD 2-Clause
 # license that can be found in the LICENSE_BSD file.
 
+import functools
+
 import jinja2
 from buildbot.plugins import util
 
 __all__ = ['GithubAuth', 'Authz']
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_template(source):
+    # parsing and compiling dominates over rendering, so compile each
+    # template source once and share it between the deepcopied instances
+    return jinja2.Template(source)
+
+
 class GithubAuth(util.GitHubAuth):
 
     def __getstate__(self):
@@ -20,7 +29,7 @@ class GithubAuth(util.GitHubAuth):
     def __setstate__(self, dct):
         self.__dict__ = dct
         if self.getTeamsMembership:
-            self.getUserTeamsGraphqlTplC = jinja2.Template(
+            self.getUserTeamsGraphqlTplC = _compile_template(
                 self.getUserTeamsGraphqlTpl.strip()
             )
 
@@ -26,10 +26,17 @@ class Formatter:
         string template used as a layout for the message
     context : dict, default None
         variables passed to the layout
+
+    Subclasses must declare the build details they use in `needed_details`,
+    e.g. `extract_logs` requires both `wantSteps` and `wantLogs`.
     """
 
     layout = '{message}'
     context = {}
+    # details of the build required for rendering the message, the reporters
+    # fetch only these, see buildbot.http.reporters.HttpStatusPushBase's
+    # neededDetails property
+    needed_details = dict(wantProperties=True)
 
     def __init__(self, layout=None, context=None):
         layout = layout or self.layout  # class' default
@@ -146,6 +153,13 @@ class Formatter:
 
 class MarkdownFormatter(Formatter):
 
+    # the steps' logs are extracted for failing builds
+    needed_details = dict(
+        wantProperties=True,
+        wantSteps=True,
+        wantLogs=True
+    )
+
     layout = textwrap.dedent("""
         [{builder_name} (#{build_id})]({build_url}) builder {status}.
 
@@ -154,13 +168,22 @@ class MarkdownFormatter(Formatter):
         {context}
     """)
 
+    # per step templates, dedented once instead of on each rendering
+    _stderr_template = textwrap.dedent("""
+        {step_name}: `{state_string}` step's stderr:
+        ```
+        {stderr}
+        ```
+    """).strip()
+    _traceback_template = textwrap.dedent("""
+        {step_name}: `{state_string}` step's traceback:
+        ```pycon
+        {traceback}
+        ```
+    """).strip()
+
     async def render_failure(self, build, master):
-        template = textwrap.dedent("""
-            {step_name}: `{state_string}` step's stderr:
-            ```
-            {stderr}
-            ```
-        """).strip()
+        template = self._stderr_template
 
         # extract stderr from logs named `stdio` from failing steps
         errors = []
@@ -178,12 +201,7 @@ class MarkdownFormatter(Formatter):
         return dict(status='failed', context='\n\n'.join(errors))
 
     async def render_exception(self, build, master):
-        template = textwrap.dedent("""
-            {step_name}: `{state_string}` step's traceback:
-            ```pycon
-            {traceback}
-            ```
-        """).strip()
+        template = self._traceback_template
 
         # steps failed with an exception usually have a log named 'err.text',
         # which contains a HTML formatted stack traceback.
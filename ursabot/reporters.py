@@ -39,6 +39,28 @@ log = Logger()
 # a build is started if build[complete] is False
 _statuses = frozenset(['started'] + Results)
 
+# maps buildbot results to github statuses
+_github_states = {
+    SUCCESS: 'success',
+    WARNINGS: 'success',
+    SKIPPED: 'success',
+    EXCEPTION: 'error',
+    CANCELLED: 'error',
+    FAILURE: 'failure',
+    RETRY: 'pending'
+}
+
+# maps buildbot results to github review events, blank means pending
+_github_review_events = {
+    SUCCESS: 'APPROVE',
+    WARNINGS: 'APPROVE',
+    SKIPPED: 'APPROVE',
+    EXCEPTION: 'REQUEST_CHANGES',
+    CANCELLED: 'REQUEST_CHANGES',
+    FAILURE: 'REQUEST_CHANGES',
+    RETRY: 'PENDING'
+}
+
 
 class HttpStatusPush(HttpStatusPushBase):
     """Makes possible to configure whether to send reports on started builds"""
@@ -100,6 +122,12 @@ class HttpStatusPush(HttpStatusPushBase):
         await self.reconfigClient(**kwargs)
         self.verbose = verbose
         self.report_on = (report_on or _statuses) - (dont_report_on or set())
+        # buildbot requires a list of builder names, but filterBuilds is
+        # called for each build event so look the names up from a set
+        if self.builders is None:
+            self._builder_names = None
+        else:
+            self._builder_names = frozenset(self.builders)
 
     async def reconfigClient(self, baseURL, headers, auth, debug, verify,
                              **kwargs):
@@ -116,7 +144,9 @@ class HttpStatusPush(HttpStatusPushBase):
         status = Results[build['results']] if build['complete'] else 'started'
         if status not in self.report_on:
             return False
-        return super().filterBuilds(build)
+        if self._builder_names is not None:
+            return build['builder']['name'] in self._builder_names
+        return True
 
     @ensure_deferred
     async def send(self, build):
@@ -182,6 +212,17 @@ class HttpStatusPush(HttpStatusPushBase):
                 )
 
 
+def _needed_details(reporter, formatter, kwargs):
+    # buildbot carries over the previous neededDetails on reconfiguration,
+    # so rebuild them from the class defaults to drop the details only the
+    # previous formatter needed, the explicitly passed want* flags win
+    return {
+        **type(reporter).neededDetails,
+        **formatter.needed_details,
+        **{k: v for k, v in kwargs.items() if k.startswith('want')}
+    }
+
+
 class GitHubReporter(HttpStatusPush):
     """Base class for reporters interacting with GitHub's API"""
 
@@ -209,6 +250,7 @@ class GitHubReporter(HttpStatusPush):
     async def reconfigService(self, formatter, **kwargs):
         await super().reconfigService(**kwargs)
         self.formatter = formatter
+        self.neededDetails = _needed_details(self, formatter, kwargs)
 
     async def reconfigClient(self, baseURL, headers, tokens, auth, debug,
                              verify, **kwargs):
@@ -285,19 +327,9 @@ class GitHubStatusPush(GitHubReporter):
         License note:
             Contains copied parts from the original buildbot implementation.
         """
-        statuses = {
-            SUCCESS: 'success',
-            WARNINGS: 'success',
-            SKIPPED: 'success',
-            EXCEPTION: 'error',
-            CANCELLED: 'error',
-            FAILURE: 'failure',
-            RETRY: 'pending'
-        }
-
         if build['complete']:
             result = build['results']
-            return statuses.get(result, 'error')
+            return _github_states.get(result, 'error')
         else:
             return 'pending'
 
@@ -311,13 +343,10 @@ class GitHubStatusPush(GitHubReporter):
             'context': await properties.render(self.context),
             'description': await self.formatter.render(build, self.master)
         }
-        urlpath = '/'.join([
-            '/repos',
-            params['repo_owner'],
-            params['repo_name'],
-            'statuses',
-            params['sha']
-        ])
+        urlpath = (
+            f"/repos/{params['repo_owner']}/{params['repo_name']}/"
+            f"statuses/{params['sha']}"
+        )
         if self.verbose:
             log.info(f'Invoking {urlpath} with payload: {payload}')
 
@@ -335,20 +364,9 @@ class GitHubReviewPush(GitHubReporter):
     name = 'GitHubReviewPush'
 
     def _event_for(self, build):
-        # maps buildbot results to github review events, blank means pending
-        events = {
-            SUCCESS: 'APPROVE',
-            WARNINGS: 'APPROVE',
-            SKIPPED: 'APPROVE',
-            EXCEPTION: 'REQUEST_CHANGES',
-            CANCELLED: 'REQUEST_CHANGES',
-            FAILURE: 'REQUEST_CHANGES',
-            RETRY: 'PENDING'
-        }
-
         if build['complete']:
             result = build['results']
-            return events.get(result, 'REQUEST_CHANGES')
+            return _github_review_events.get(result, 'REQUEST_CHANGES')
         else:
             return 'PENDING'
 
@@ -366,14 +384,10 @@ class GitHubReviewPush(GitHubReporter):
             'event': self._event_for(build),
             'body': await self.formatter.render(build, master=self.master)
         }
-        urlpath = '/'.join([
-            '/repos',
-            params['repo_owner'],
-            params['repo_name'],
-            'pulls',
-            params['issue'],
-            'reviews'
-        ])
+        urlpath = (
+            f"/repos/{params['repo_owner']}/{params['repo_name']}/"
+            f"pulls/{params['issue']}/reviews"
+        )
         if self.verbose:
             log.info(f'Invoking {urlpath} with payload: {payload}')
 
@@ -389,7 +403,8 @@ class GitHubCommentPush(GitHubReporter):
     name = 'GitHubCommentPush'
 
     # the formatter will receive all of the following details
-    # as nested dictionaries under the build variable
+    # as nested dictionaries under the build variable, regardless of the
+    # formatter's needed_details
     neededDetails = dict(
         wantProperties=True,
         wantSteps=True,
@@ -443,9 +458,7 @@ class ZulipStatusPush(HttpStatusPush):
 
     name = 'ZulipStatusPush'
     neededDetails = dict(
-        wantProperties=True,
-        wantSteps=True,
-        wantLogs=True
+        wantProperties=True
     )
 
     def __init__(self, organization, bot, apikey, stream, topic=None,
@@ -474,6 +487,7 @@ class ZulipStatusPush(HttpStatusPush):
         self.topic = topic
         self.stream = stream
         self.formatter = formatter
+        self.neededDetails = _needed_details(self, formatter, kwargs)
 
     @ensure_deferred
     async def report(self, build, sourcestamp, properties):
@@ -21,7 +21,7 @@ from buildbot.test.util.reporter import ReporterTestMixin
 from ursabot.reporters import (HttpStatusPush, ZulipStatusPush,
                                GitHubStatusPush, GitHubReviewPush,
                                GitHubCommentPush)
-from ursabot.formatters import Formatter
+from ursabot.formatters import Formatter, MarkdownFormatter
 from ursabot.builders import Builder
 from ursabot.utils import ensure_deferred
 from ursabot.tests.mocks import GithubClientService
@@ -319,6 +319,24 @@ class TestGitHubCommentPush(GithubReporterTestCase):
 
     Reporter = GitHubCommentPush
 
+    @ensure_deferred
+    async def test_needed_details_depend_on_the_formatter(self):
+        # the comment push always fetches the steps and logs, because custom
+        # formatters may extract the logs without declaring needed_details
+        expected = {
+            'wantProperties': True,
+            'wantSteps': True,
+            'wantLogs': True
+        }
+        reporter = await self.setupReporter()
+        assert reporter.neededDetails == expected
+
+        for formatter in [Formatter(), MarkdownFormatter()]:
+            sibling = GitHubCommentPush(tokens=self.TOKENS,
+                                        formatter=formatter)
+            await reporter.reconfigServiceWithSibling(sibling)
+            assert reporter.neededDetails == expected
+
     @ensure_deferred
     async def test_basic(self):
         self._http.expect(
@@ -428,6 +446,28 @@ class TestZulipStatusPush(HttpReporterTestCase):
         await reporter.setServiceParent(self.master)
         return reporter
 
+    @ensure_deferred
+    async def test_needed_details_depend_on_the_formatter(self):
+        reporter = await self.setupReporter(name='plain')
+        assert reporter.neededDetails == {'wantProperties': True}
+
+        reporter = ZulipStatusPush(organization='testorg', bot='ursabot',
+                                   apikey='secret', stream='blueberry',
+                                   formatter=MarkdownFormatter())
+        await reporter.setServiceParent(self.master)
+        assert reporter.neededDetails == {
+            'wantProperties': True,
+            'wantSteps': True,
+            'wantLogs': True
+        }
+
+        # reconfiguring with a formatter needing less details
+        sibling = ZulipStatusPush(organization='testorg', bot='ursabot',
+                                  apikey='secret', stream='blueberry',
+                                  formatter=Formatter())
+        await reporter.reconfigServiceWithSibling(sibling)
+        assert reporter.neededDetails == {'wantProperties': True}
+
     @ensure_deferred
     async def test_topic_is_renderable(self):
         @renderer
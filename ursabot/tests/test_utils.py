@@ -8,17 +8,26 @@
 # derivative works of Buildbot. The above license only applies to code that
 # is not marked as such.
 
+import re
 import json
 import mock
+from pathlib import Path
+from unittest.mock import MagicMock, Mock
 from collections import namedtuple
 from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Union
 
-from twisted.internet import reactor
+import pytest
+
+from twisted.internet import defer, reactor
 from twisted.trial import unittest
 from buildbot.util import httpclientservice
 from buildbot.util import service
 
-from ursabot.utils import GithubClientService, Filter, Glob, ensure_deferred
+from ursabot.utils import (GithubClientService, Annotable, AnyMatching, Filter,
+                           Glob, Has, Matching, ensure_deferred,
+                           read_dependency_list, _dependency_lists,
+                           _glob_matcher)
 
 
 def test_filter():
@@ -45,6 +54,8 @@ def test_filter():
     ]
 
     f = Filter(name=Glob('t*'))
+    assert f(items[0]) is True
+    assert f(items[2]) is False
     assert filter_list(f, items) == [
         Item(name='tset', id=1),
         Item(name='test', id=2),
@@ -53,6 +64,159 @@ def test_filter():
     ]
 
 
+def test_matching():
+    is_python = Matching('*.py')
+    assert is_python('setup.py')
+    assert is_python('ursabot/utils.py')
+    assert not is_python('setup.cfg')
+
+    is_none = Matching(None)
+    assert is_none(None)
+    assert not is_none('None')
+
+    assert Matching('amd64')('amd64')
+    assert not Matching('amd64')('arm64v8')
+    assert Matching('python-3.?')('python-3.7')
+    assert Matching('[ab]*')('bc')
+    assert not Matching('[ab]*')('cb')
+    assert Matching('*test*')('pytest-cov')
+
+
+def test_any_matching():
+    is_source = AnyMatching('*.py', '*.pyx', 'cpp/*')
+    assert is_source('setup.py')
+    assert is_source('_lib.pyx')
+    assert is_source('cpp/src/arrow.cc')
+    assert not is_source('README')
+    assert AnyMatching('amd64')('amd64')
+    assert not AnyMatching('amd64')('arm64v8')
+
+    with pytest.raises(ValueError):
+        AnyMatching()
+
+    Item = namedtuple('Item', ('name', 'id'))
+    items = [
+        Item(name='setup.py', id=1),
+        Item(name='_lib.pyx', id=2),
+        Item(name='setup.cfg', id=3)
+    ]
+    f = Filter(name=AnyMatching('*.py', '*.pyx'))
+    assert list(filter(f, items)) == items[:2]
+
+
+def test_filter_compiles_glob_once():
+    Item = namedtuple('Item', ('name', 'id'))
+    items = [Item(name='tset', id=1), Item(name='else', id=2)] * 5000
+
+    # the pattern requires a regex, unlike the ones having wildcards only at
+    # their ends
+    _glob_matcher.cache_clear()
+    with mock.patch('re.compile', wraps=re.compile) as compile:
+        f = Filter(name=Matching('t?e*t'))
+        matches = list(filter(f, items))
+
+    assert compile.call_count == 1
+    assert matches == [Item(name='tset', id=1)] * 5000
+
+
+def test_has():
+    has = Has('cuda', 'arm')
+    assert has(['arm', 'cuda', 'gpu'])
+    assert has({'arm', 'cuda'})
+    assert has(iter(['cuda', 'arm']))
+    assert not has(['cuda'])
+    assert not has([])
+    assert Has()([])
+
+
+def test_annotable_validates_types():
+    class Test(Annotable):
+        name: str
+        # parametrized generics are classes on python 3.6, but they cannot be
+        # used with isinstance
+        tags: List[str] = []
+        env: Dict[str, Union[int, str]] = {}
+        path: Optional[Union[Path, str]] = None
+        fn: Optional[Callable] = None
+        # bare generics and typing.Any (which is a class on python 3.11)
+        items: List = []
+        meta: Dict[str, Any] = {}
+        extra: Any = None
+
+    t = Test(name='a', tags=['b'], env={'c': 1, 'd': 'D'}, path=Path('e'),
+             fn=print, items=[1, 'f'], meta={'g': None}, extra=object)
+    assert t.asdict() == {
+        'name': 'a',
+        'tags': ['b'],
+        'env': {'c': 1, 'd': 'D'},
+        'path': Path('e'),
+        'fn': print,
+        'items': [1, 'f'],
+        'meta': {'g': None},
+        'extra': object
+    }
+
+    # mutable defaults are copied for each instance
+    a, b = Test(name='a'), Test(name='b')
+    a.tags.append('c')
+    a.env['d'] = 1
+    assert b.tags == [] and b.env == {}
+    assert Test.tags == [] and Test.env == {}
+
+    # mocks are accepted for any annotation, like typeguard does
+    t = Test(name=Mock(), tags=Mock(), env={'c': Mock()}, path=Mock(),
+             items=Mock(), meta=MagicMock())
+    assert isinstance(t.tags, Mock)
+
+    invalid_arguments = [
+        dict(name=1),
+        dict(name='a', tags='b'),
+        dict(name='a', tags=['b', 1]),
+        dict(name='a', env=[]),
+        dict(name='a', env={1: 'c'}),
+        dict(name='a', env={'c': None}),
+        dict(name='a', path=1),
+        dict(name='a', fn='print'),
+        dict(name='a', items={}),
+        dict(name='a', meta={1: 'h'}),
+    ]
+    for kwargs in invalid_arguments:
+        with pytest.raises(TypeError):
+            Test(**kwargs)
+
+
+def test_annotable_accepts_bytes_like_values():
+    # typeguard treats bytes as a bytes-like annotation
+    class Test(Annotable):
+        data: bytes
+        chunks: List[bytes] = []
+
+    for value in [b'a', bytearray(b'a'), memoryview(b'a')]:
+        assert Test(data=value, chunks=[value]).data is value
+
+    with pytest.raises(TypeError):
+        Test(data='a')
+
+
+def test_read_dependency_list(tmp_path):
+    n_cached = len(_dependency_lists)
+    path = tmp_path / 'deps.txt'
+    path.write_text('# comment\nnumpy\n\n  pandas \n')
+    deps = read_dependency_list(path)
+    assert deps == ['numpy', 'pandas']
+
+    # callers receive a fresh list each time
+    deps.append('pyarrow')
+    assert read_dependency_list(str(path)) == ['numpy', 'pandas']
+
+    # modifying the file invalidates the cached list
+    path.write_text('numpy\npandas\npyarrow\n')
+    assert read_dependency_list(path) == ['numpy', 'pandas', 'pyarrow']
+
+    # without leaving the stale entry behind
+    assert len(_dependency_lists) == n_cached + 1
+
+
 Request = namedtuple('Request', ['method', 'url', 'params', 'headers', 'data'])
 Response = namedtuple('Response', ['code', 'headers', 'body'])
 
@@ -84,6 +248,9 @@ class GithubClientServiceTest(unittest.TestCase):
         )
         await self.parent.startService()
 
+    def tearDown(self):
+        return self.parent.stopService()
+
     @contextmanager
     def responses(self, responses):
         # otherwise it bails pytest because of a DeprecationWarning
@@ -101,6 +268,23 @@ class GithubClientServiceTest(unittest.TestCase):
         finally:
             assert failures == []
 
+    def request(self, path, token):
+        from treq.testing import HasHeaders
+        return Request(
+            method=b'get',
+            url=f'https://api.github.com/{path}',
+            params=mock.ANY,
+            headers=HasHeaders({'Authorization': [f'token {token}']}),
+            data=mock.ANY
+        )
+
+    def response(self, code, remaining, body=None):
+        return Response(
+            code=code,
+            headers={'X-RateLimit-Remaining': f'{remaining}'},
+            body=as_json(body or {})
+        )
+
     @ensure_deferred
     async def test_fetching_rate_limit(self):
         from treq.testing import HasHeaders
@@ -198,6 +382,22 @@ class GithubClientServiceTest(unittest.TestCase):
                     body=as_json({'rate': {'remaining': 5000}})
                 )
             ),
+            # the unknown rate limits are queried concurrently, but token A's
+            # one is known from the last response
+            (
+                Request(
+                    method=b'get',
+                    url='https://api.github.com/rate_limit',
+                    params=mock.ANY,
+                    headers=HasHeaders({'Authorization': ['token C']}),
+                    data=mock.ANY
+                ),
+                Response(
+                    code=200,
+                    headers={'X-RateLimit-Remaining': '3000'},
+                    body=as_json({'rate': {'remaining': 3000}})
+                )
+            ),
             (
                 Request(
                     method=b'get',
@@ -300,3 +500,80 @@ class GithubClientServiceTest(unittest.TestCase):
         with self.responses(responses):
             await self.http.get('/repos/ursa-labs/ursabot')
             await self.http.get('/repos/ursa-labs/ursabot')
+
+    @ensure_deferred
+    async def test_rotation_to_token_with_known_rate_limit(self):
+        request, response = self.request, self.response
+        responses = [
+            (request('repos/ursa-labs/ursabot', 'A'), response(200, 4000)),
+            (request('repos/ursa-labs/private', 'A'), response(404, 3999)),
+            (request('rate_limit', 'B'),
+             response(200, 900, {'rate': {'remaining': 900}})),
+            (request('rate_limit', 'C'),
+             response(200, 5000, {'rate': {'remaining': 5000}})),
+            (request('repos/ursa-labs/private', 'C'), response(404, 4999)),
+            # the remaining rate limit of token A is known, so there is no
+            # need to query it again
+            (request('repos/ursa-labs/private', 'A'), response(200, 3998)),
+        ]
+
+        with self.responses(responses):
+            await self.http.get('/repos/ursa-labs/ursabot')
+            await self.http.get('/repos/ursa-labs/private')
+
+    @ensure_deferred
+    async def test_rotation_refreshes_known_insufficient_rate_limits(self):
+        request, response = self.request, self.response
+
+        # the rate limits of the other tokens were insufficient when they
+        # were last seen, but they may have been reset since then
+        self.http._remaining.update({'B': 900, 'C': 500})
+        responses = [
+            (request('repos/ursa-labs/ursabot', 'A'), response(200, 1000)),
+            (request('rate_limit', 'B'),
+             response(200, 5000, {'rate': {'remaining': 5000}})),
+            (request('rate_limit', 'C'),
+             response(200, 500, {'rate': {'remaining': 500}})),
+            (request('rate_limit', 'A'),
+             response(200, 1000, {'rate': {'remaining': 1000}})),
+            (request('repos/ursa-labs/ursabot', 'B'), response(200, 4999)),
+        ]
+
+        with self.responses(responses):
+            await self.http.get('/repos/ursa-labs/ursabot')
+            await self.http.get('/repos/ursa-labs/ursabot')
+
+    @ensure_deferred
+    async def test_concurrent_rotations_are_coalesced(self):
+        rotation = defer.Deferred()
+        rotate_tokens = mock.Mock(return_value=rotation)
+        self.patch(self.http, 'rotate_tokens', rotate_tokens)
+
+        first = defer.ensureDeferred(self.http._rotate_tokens_once())
+        second = defer.ensureDeferred(self.http._rotate_tokens_once())
+        assert rotate_tokens.call_count == 1
+        assert not first.called and not second.called
+
+        rotation.callback(None)
+        await first
+        await second
+
+        # a subsequent rotation starts a new one
+        rotate_tokens.return_value = defer.succeed(None)
+        await self.http._rotate_tokens_once()
+        assert rotate_tokens.call_count == 2
+
+    @ensure_deferred
+    async def test_failed_rotation_is_propagated_to_every_waiter(self):
+        rotation = defer.Deferred()
+        rotate_tokens = mock.Mock(return_value=rotation)
+        self.patch(self.http, 'rotate_tokens', rotate_tokens)
+
+        first = self.http._rotate_tokens_once()
+        second = self.http._rotate_tokens_once()
+        assert rotate_tokens.call_count == 1
+
+        rotation.errback(ValueError('rotation failed'))
+        for waiter in (first, second):
+            with pytest.raises(ValueError):
+                await waiter
@@ -4,18 +4,22 @@
 # Use of this source code is governed by a BSD 2-Clause
 # license that can be found in the LICENSE_BSD file.
 
+import re
 import copy
 import platform
 import pathlib
 import fnmatch
+import operator
 import itertools
-from functools import wraps
-from typing import ClassVar
+from types import MappingProxyType
+from functools import wraps, partial, lru_cache
+from typing import ClassVar, Dict, List, Union
+from unittest.mock import Mock
 
 import distro
-import toolz
 import typeguard
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from buildbot.util import httpclientservice
 from buildbot.util.logger import Logger
 
@@ -26,6 +30,7 @@ __all__ = [
     'AllOf',
     'Matching',
     'Glob',
+    'AnyMatching',
     'Filter',
     'Annotable',
     'Merge',
@@ -38,19 +43,36 @@ log = Logger()
 
 
 def ensure_deferred(fn):
+    ensure = defer.ensureDeferred
+
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        result = fn(*args, **kwargs)
-        return defer.ensureDeferred(result)
+        return ensure(fn(*args, **kwargs))
 
     return wrapper
 
 
+_dependency_lists = {}
+
+
 def read_dependency_list(path):
-    """Parse plaintext files with comments as list of dependencies"""
-    path = pathlib.Path(path)
-    lines = (l.strip() for l in path.read_text().splitlines())
-    return [l for l in lines if not l.startswith('#')]
+    """Parse plaintext files with comments as list of dependencies
+
+    The parsed lists are cached until the file gets modified, a new list is
+    returned on each call so the callers are free to mutate it.
+    """
+    path = pathlib.Path(path).resolve()
+    stat = path.stat()
+    # keep a single entry per file, replaced whenever the file changes
+    key, stamp = str(path), (stat.st_mtime_ns, stat.st_size)
+    cached_stamp, dependencies = _dependency_lists.get(key, (None, None))
+    if cached_stamp != stamp:
+        lines = path.read_text().splitlines()
+        dependencies = [
+            l for l in map(str.strip, lines) if l and not l.startswith('#')
+        ]
+        _dependency_lists[key] = (stamp, dependencies)
+    return list(dependencies)
 
 
 # Utilities for validation and declarative definitions
@@ -84,14 +106,103 @@ class MISSING:
     pass
 
 
+def _is_plain_class(tp):
+    # typeguard has special handling for these classes, typing constructs
+    # like List[str] on python 3.6 or Any on python 3.11 are classes too, but
+    # cannot be used with isinstance
+    return (
+        isinstance(tp, type) and
+        tp.__module__ != 'typing' and
+        not hasattr(tp, '__origin__') and
+        not issubclass(tp, (tuple, float, complex, bytes)) and
+        not getattr(tp, '_is_protocol', False)
+    )
+
+
+def _reject(name, value, expected):
+    # like typeguard, let mocks through
+    if not isinstance(value, Mock):
+        raise TypeError(f'type of {name} must be {expected}; '
+                        f'got {type(value).__qualname__} instead')
+
+
+@lru_cache(maxsize=None)
+def _make_checker(tp):
+    """Create a validator function for a type annotation
+
+    Plain classes, unions of plain classes, and lists or dictionaries of
+    those are checked directly with isinstance, the rest of the annotations
+    are validated with typeguard, which inspects the annotation on each call.
+    """
+    origin = getattr(tp, '__origin__', None)
+    args = getattr(tp, '__args__', None) or ()
+    generic = not getattr(tp, '__parameters__', ())
+
+    if _is_plain_class(tp):
+        def check(name, value):
+            if not isinstance(value, tp):
+                _reject(name, value, tp.__qualname__)
+    elif origin is Union and all(map(_is_plain_class, args)):
+        expected = 'one of ({})'.format(
+            ', '.join(t.__qualname__ for t in args)
+        )
+
+        def check(name, value):
+            if not isinstance(value, args):
+                _reject(name, value, expected)
+    elif origin in (list, List) and generic and len(args) == 1:
+        check_item = _make_checker(args[0])
+
+        def check(name, value):
+            if not isinstance(value, list):
+                return _reject(name, value, 'a list')
+            for i, item in enumerate(value):
+                check_item(f'{name}[{i}]', item)
+    elif origin in (dict, Dict) and generic and len(args) == 2:
+        check_key, check_value = map(_make_checker, args)
+
+        def check(name, value):
+            if not isinstance(value, dict):
+                return _reject(name, value, 'a dict')
+            for k, v in value.items():
+                check_key(f'keys of {name}', k)
+                check_value(f'{name}[{k!r}]', v)
+    else:
+        def check(name, value):
+            typeguard.check_type(name, value, tp)
+
+    return check
+
+
+def _identity(value):
+    return value
+
+
 class Field:
 
-    __slots__ = ('name', 'type', 'default')
+    __slots__ = ('name', 'type', 'default', '_check', '_copier')
+
+    # copying instances of these types is pointless
+    _immutable_types = frozenset({
+        type(None), bool, int, float, str, bytes, tuple, frozenset
+    })
+    # the common mutable defaults are copied with their own methods instead
+    # of dispatching through copy.copy
+    _copiers = {
+        dict: dict.copy,
+        list: list.copy,
+        set: set.copy
+    }
 
     def __init__(self, name, type, default):
         self.name = name
         self.type = type
         self.default = default
+        self._check = _make_checker(type)
+        if default.__class__ in self._immutable_types:
+            self._copier = _identity
+        else:
+            self._copier = self._copiers.get(default.__class__, copy.copy)
         if default is not MISSING:
             self.validate(default)
 
@@ -99,7 +210,7 @@ class Field:
         return Field(name=self.name, type=self.type, default=new_default)
 
     def validate(self, value):
-        typeguard.check_type(self.name, value, self.type)
+        self._check(self.name, value)
 
 
 class AnnotableMeta(type):
@@ -123,6 +234,12 @@ class AnnotableMeta(type):
         attrs['__class_fields__'] = metacls._update_fields(
             class_anns, class_fields, attrs
         )
+        # instances are constructed way more often than classes, so iterate
+        # over a precomputed tuple instead of the fields dictionary
+        attrs['__field_tuple__'] = tuple(attrs['__fields__'].values())
+        attrs['__getters__'] = tuple(
+            operator.attrgetter(name) for name in attrs['__fields__']
+        )
 
         return super().__new__(metacls, clsname, bases, attrs)
 
@@ -150,20 +267,23 @@ class Annotable(metaclass=AnnotableMeta):
 
     def __init__(self, **kwargs):
         # TODO(kszucs): collect errors
-        for name, field in self.__fields__.items():
+        for field in self.__field_tuple__:
+            name, default = field.name, field.default
             try:
                 value = kwargs[name]
-                if isinstance(value, Marker):
-                    value = value.resolve(field.default)
             except KeyError:
-                if field.default is MISSING:
+                # the default has already been validated by the field
+                if default is MISSING:
                     raise TypeError(
                         f'missing required keyword-only argument: {name}'
                     )
                 else:
-                    value = copy.copy(field.default)
+                    value = field._copier(default)
+            else:
+                if isinstance(value, Marker):
+                    value = value.resolve(default)
+                field.validate(value)
 
-            field.validate(value)
             setattr(self, name, value)
 
     def __repr__(self):
@@ -174,13 +294,12 @@ class Annotable(metaclass=AnnotableMeta):
 
     def __eq__(self, other):
         return (
-            type(self) == type(other) and
-            self.asdict() == other.asdict()
+            type(self) is type(other) and
+            all(get(self) == get(other) for get in self.__getters__)
         )
 
     def _values(self):
-        for name in self.__fields__.keys():
-            yield (name, getattr(self, name))
+        return zip(self.__fields__, (get(self) for get in self.__getters__))
 
     def asdict(self):
         return dict(self._values())
@@ -190,61 +309,124 @@ class Annotable(metaclass=AnnotableMeta):
 
 
 def Has(*needles):
-    return lambda haystack: set(needles).issubset(set(haystack))
+    needles = frozenset(needles)
+    return lambda haystack: needles.issubset(haystack)
 
 
 def InstanceOf(cls):
     return lambda value: isinstance(value, cls)
 
 
+_glob_special_chars = frozenset('*?[')
+
+
+@lru_cache(maxsize=None)
+def _glob_matcher(pattern):
+    """Create a string predicate equivalent to fnmatch's matching
+
+    Literal patterns and patterns having wildcards only at their ends are
+    checked with plain string methods, the others are translated and compiled
+    to a regex once, so the predicates created for the same pattern share it.
+    """
+    core = pattern.strip('*')
+    if _glob_special_chars.isdisjoint(core):
+        prefixed, suffixed = pattern.startswith('*'), pattern.endswith('*')
+        if prefixed and suffixed:
+            return lambda v: core in v
+        elif prefixed:
+            return lambda v: v.endswith(core)
+        elif suffixed:
+            return lambda v: v.startswith(core)
+        else:
+            return lambda v: v == pattern
+
+    match = re.compile(fnmatch.translate(pattern)).match
+    return lambda v: match(v) is not None
+
+
 def Matching(pattern):
     if pattern is None:
         return lambda v: v is None
     else:
-        return lambda v: fnmatch.fnmatch(str(v), pattern)
+        match = _glob_matcher(pattern)
+        return lambda v: match(str(v))
 
 
 def Glob(pattern):
-    return lambda vs: fnmatch.filter(vs, pattern)
+    match = _glob_matcher(pattern)
+    return lambda vs: [v for v in vs if match(v)]
+
+
+@lru_cache(maxsize=None)
+def _any_glob_matcher(patterns):
+    if len(patterns) == 1:
+        return _glob_matcher(patterns[0])
+    regex = '|'.join(f'(?:{fnmatch.translate(p)})' for p in patterns)
+    match = re.compile(regex).match
+    return lambda v: match(v) is not None
+
+
+def AnyMatching(*patterns):
+    """Check whether the value matches any of the glob patterns
+
+    Equivalent to AnyOf(Matching(...), Matching(...)) but the patterns are
+    combined into a single regex, so each value is scanned only once.
+    """
+    if not patterns:
+        raise ValueError('at least one pattern is required')
+    match = _any_glob_matcher(patterns)
+    return lambda v: match(str(v))
+
+
+def _split_validators(validators):
+    # literal validators are compared against the value, the callable ones
+    # are applied to it; partition them once instead of on each check
+    callables = tuple(v for v in validators if callable(v))
+    literals = tuple(v for v in validators if not callable(v))
+    return callables, literals
 
 
 def AnyOf(*validators):
+    callables, literals = _split_validators(validators)
+
     def check(value):
-        for validator in validators:
-            if callable(validator):
-                if validator(value):
-                    return True
-            else:
-                if value == validator:
-                    return True
-        return False
+        return value in literals or any(v(value) for v in callables)
     return check
 
 
 def AllOf(*validators):
+    callables, literals = _split_validators(validators)
+
     def check(value):
-        for validator in validators:
-            if callable(validator):
-                if not validator(value):
-                    return False
-            else:
-                if value != validator:
-                    return False
-        return True
+        return (
+            all(value == v for v in literals) and
+            all(v(value) for v in callables)
+        )
     return check
 
 
+def _as_predicate(validator):
+    if callable(validator):
+        return validator
+    else:
+        return partial(operator.eq, validator)
+
+
 def Filter(**kwargs):
+    # bind the attribute getters and the predicates once, so the checks
+    # don't need to dispatch on the validators' type for each object
+    checks = tuple(
+        (operator.attrgetter(attr), _as_predicate(validator))
+        for attr, validator in kwargs.items()
+    )
+
+    if len(checks) == 1:
+        # the most common case, e.g. Filter(name=...)
+        (getter, predicate), = checks
+        return lambda obj: bool(predicate(getter(obj)))
+
     def check(obj):
-        for attr, validator in kwargs.items():
-            value = getattr(obj, attr)
-            if callable(validator):
-                if not validator(value):
-                    return False
-            else:
-                if value != validator:
-                    return False
-        return True
+        return all(predicate(getter(obj)) for getter, predicate in checks)
     return check
 
 
@@ -296,12 +478,13 @@ def Filter(**kwargs):
 
 class Platform:
 
-    __slots__ = ('arch', 'system', 'distro', 'version', 'codename')
+    __slots__ = ('arch', 'system', 'distro', 'version', 'codename',
+                 '_key', '_hash', '_str')
 
-    _architectures = {
+    _architectures = MappingProxyType({
         'x86_64': 'amd64'
-    }
-    _systems = {
+    })
+    _systems = MappingProxyType({
         'debian': 'linux',
         'ubuntu': 'linux',
         'centos': 'linux',
@@ -309,7 +492,9 @@ class Platform:
         'fedora': 'linux',
         'macos': 'darwin',
         'windows': 'windows'
-    }
+    })
+    # the host platform doesn't change during the process' lifetime
+    _detected = None
 
     def __init__(self, arch, distro, version, system=None, codename=None):
         arch = self._architectures.get(arch, arch)
@@ -326,25 +511,25 @@ class Platform:
         self.version = version
         self.codename = codename
 
+        # platforms are used as dictionary keys, so precompute the values
+        # depending on the otherwise unchanged attributes
+        self._key = (arch, system, distro, version)
+        self._hash = hash(self._key)
+        self._str = (
+            f'{arch or "unknown"}-{distro or "unknown"}-{version or "unknown"}'
+        )
+
     def title(self):
         return f'{self.arch.upper()} {self.distro.capitalize()} {self.version}'
 
     def __eq__(self, other):
-        return (
-            self.arch == other.arch and
-            self.system == other.system and
-            self.distro == other.distro and
-            self.version == other.version
-        )
+        return self._key == other._key
 
     def __hash__(self):
-        return hash((self.arch, self.system, self.distro, self.version))
+        return self._hash
 
     def __str__(self):
-        arch = self.arch or 'unknown'
-        distro = self.distro or 'unknown'
-        version = self.version or 'unknown'
-        return f'{arch}-{distro}-{version}'
+        return self._str
 
     def __repr__(self):
         return (f'<Platform arch={self.arch} system={self.system} '
@@ -352,6 +537,12 @@ class Platform:
 
     @classmethod
     def detect(cls):
+        if cls._detected is None:
+            cls._detected = cls._detect()
+        return cls._detected
+
+    @classmethod
+    def _detect(cls):
         system = platform.system().lower()
         if system == 'windows':
             dist = 'windows'
@@ -385,27 +576,52 @@ class HTTPClientService(httpclientservice.HTTPClientService):
     def _prepareRequest(self, ep, kwargs):
         # XXX: originally the default headers and the headers received as an
         # arguments were merged in the wrong order
-        default_headers = self._headers or {}
-        headers = kwargs.pop('headers', None) or {}
+        headers = kwargs.pop('headers', None)
 
+        # the parent method already creates a fresh dictionary containing the
+        # default headers, so only update it with the explicit ones
         url, kwargs = super()._prepareRequest(ep, kwargs)
-        kwargs['headers'] = {**default_headers, **headers}
+        if headers:
+            kwargs['headers'].update(headers)
 
         return url, kwargs
 
 
+_github_error_reasons = {
+    # Unauthorized: bad credentials
+    401: 'bad credentials (401)',
+    # Forbidden: exceeded rate limit or forbidden access
+    403: 'exceeded rate limit or forbidden access (403)',
+    # Requests that require authentication will return 404 Not Found, instead
+    # of 403 Forbidden, in some places. This is to prevent the accidental
+    # leakage of private repositories to unauthorized users.
+    404: 'resource not found (404)'
+}
+
+
 class GithubClientService(HTTPClientService):
 
     def __init__(self, *args, tokens, rotate_at=1000, max_retries=5,
                  headers=None, **kwargs):
         assert rotate_at < 5000
         tokens = list(tokens)
+        self._authorizations = {t: f'token {t}' for t in tokens}
         self._tokens = itertools.cycle(tokens)
         self._n_tokens = len(tokens)
         self._rotate_at = rotate_at
         self._max_retries = max_retries
-        headers = headers or {}
-        headers.setdefault('User-Agent', 'Buildbot')
+        # last seen remaining rate limit of the tokens
+        self._remaining = {}
+        # requests waiting for the ongoing token rotation, None if there is
+        # no rotation in progress
+        self._rotation_waiters = None
+        # the authorization header gets overwritten on each token rotation,
+        # so allocate its slot upfront, startService sets the first token
+        headers = {
+            'User-Agent': 'Buildbot',
+            **(headers or {}),
+            'Authorization': ''
+        }
         super().__init__(*args, headers=headers, **kwargs)
 
     def startService(self):
@@ -413,65 +629,125 @@ class GithubClientService(HTTPClientService):
         return super().startService()
 
     def _set_token(self, token):
-        if self._headers is None:
-            self._headers = {}
-        self._headers['Authorization'] = f'token {token}'
+        self._headers['Authorization'] = self._authorizations[token]
+        self._token = token
 
     @ensure_deferred
     async def rate_limit(self, token=None):
         headers = {}
         if token is not None:
-            headers['Authorization'] = f'token {token}'
+            headers['Authorization'] = (
+                self._authorizations.get(token) or f'token {token}'
+            )
+        else:
+            token = self._token
 
         response = await self._doRequest('get', '/rate_limit', headers=headers)
         data = await response.json()
 
-        return data['rate']['remaining']
+        remaining = self._remaining[token] = data['rate']['remaining']
+        return remaining
+
+    def _has_sufficient_rate_limit(self, token):
+        return self._remaining.get(token, 0) > self._rotate_at
+
+    async def _probe_rate_limits(self, tokens):
+        results = await defer.DeferredList(
+            [defer.ensureDeferred(self.rate_limit(t)) for t in tokens],
+            consumeErrors=True
+        )
+        for success, result in results:
+            if not success:
+                log.failure('Failed to query the rate limit of a token',
+                            failure=result)
+
+    def _select_token(self, tokens):
+        for i, token in enumerate(tokens):
+            if self._has_sufficient_rate_limit(token):
+                # leave the cycle positioned right after the selected token
+                next(itertools.islice(self._tokens, i, None))
+                self._set_token(token)
+                return True
+        return False
 
     @ensure_deferred
     async def rotate_tokens(self):
-        # try each token, query its rate limit
+        # try each token in order, the ones preceding the first token already
+        # known to have a sufficient rate limit are the candidates
+        tokens = list(itertools.islice(self._tokens, self._n_tokens))
+        candidates = list(itertools.takewhile(
+            lambda token: not self._has_sufficient_rate_limit(token), tokens
+        ))
+
+        # first query the unknown rate limits concurrently, the current
+        # token's one has just been received or the token has just failed
+        unknown = [
+            t for t in candidates
+            if t not in self._remaining and t != self._token
+        ]
+        if unknown:
+            await self._probe_rate_limits(unknown)
+        if self._select_token(tokens):
+            return
+
+        # then refresh the known but insufficient ones, they may have been
+        # reset since they were seen
+        known = [t for t in candidates if t not in unknown]
+        if known:
+            await self._probe_rate_limits(known)
         # if none of them works log and sleep
-        for token in toolz.take(self._n_tokens, self._tokens):
-            remaining = await self.rate_limit(token)
-
-            if remaining > self._rotate_at:
-                return self._set_token(token)
+        self._select_token(tokens)
+
+    def _rotate_tokens_once(self):
+        # concurrent requests failing at the same time would trigger separate
+        # token rotations, so wait for the ongoing one instead; each waiter
+        # gets its own deferred, because awaiting a shared one would consume
+        # its result
+        waiter = defer.Deferred()
+        if self._rotation_waiters is None:
+            self._rotation_waiters = [waiter]
+            self.rotate_tokens().addBoth(self._notify_rotation_waiters)
+        else:
+            self._rotation_waiters.append(waiter)
+        return waiter
+
+    def _notify_rotation_waiters(self, result):
+        waiters, self._rotation_waiters = self._rotation_waiters, None
+        for waiter in waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
 
     @ensure_deferred
     async def _do_request(self, method, endpoint, **kwargs):
         for attempt in range(self._max_retries):
+            token = self._token
             response = await self._doRequest(method, endpoint, **kwargs)
             headers, code = response.headers, response.code
 
-            if code // 100 == 4:
-                if code == 401:
-                    # Unauthorized: bad credentials
-                    reason = 'bad credentials (401)'
-                elif code == 403:
-                    # Forbidden: exceeded rate limit or forbidden access
-                    reason = 'exceeded rate limit or forbidden access (403)'
-                elif code == 404:
-                    # Requests that require authentication will return 404 Not
-                    # Found, instead of 403 Forbidden, in some places. This is
-                    # to prevent the accidental leakage of private repositories
-                    # to unauthorized users.
-                    reason = 'resource not found (404)'
-                else:
+            if 400 <= code < 500:
+                reason = _github_error_reasons.get(code)
+                if reason is None:
                     reason = f'status code {code}'
 
+                if code in {401, 403}:
+                    # the remaining rate limit of the token is unreliable
+                    self._remaining.pop(token, None)
+
                 log.info(f'Failed to fetch endpoint {endpoint} because of '
                          f' {reason}. Retrying with the next token.')
-                await self.rotate_tokens()
+                await self._rotate_tokens_once()
             else:
                 if headers.hasHeader('X-RateLimit-Remaining'):
                     values = headers.getRawHeaders('X-RateLimit-Remaining')
-                    remaining = int(toolz.first(values))
+                    remaining = int(values[0])
+                    self._remaining[token] = remaining
                     if remaining <= self._rotate_at:
                         log.info('Remaining rate limit has reached the '
                                  'rotation limit, switching to the next '
                                  'token.')
-                        await self.rotate_tokens()
+                        await self._rotate_tokens_once()
                 break
 
         return response